@@ -0,0 +1,349 @@
+import re
+import sys
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
+
+INDEXED_TOKEN_ATTRIBUTES = ("form", "lemma", "xpos")
+# Yes/no token attributes, stored as one bit each
+TOKEN_FLAGS = (
+    "unclear",
+    "truncated",
+    "vocal",
+    "pause_before",
+    "pause_after",
+    "unintelligible",
+)
+
+# A constraint value is either a literal string or a compiled regex (/.../ in the sample query)
+Value = str | re.Pattern
+Constraints = dict[str, Value]
+
+
+def matches(value: str | None, expected: Value) -> bool:
+    if value is None:
+        return False
+    if isinstance(expected, re.Pattern):
+        return expected.search(value) is not None
+    return value == expected
+
+
+class IntervalTree:
+    """
+    Static centered interval tree over half-open ranges [lower, upper).
+    Each node keeps the intervals containing its center, sorted by lower and by upper bound.
+    """
+
+    def __init__(self, intervals: list[tuple[int, int, int]]):
+        self.center = 0
+        self.left: IntervalTree | None = None
+        self.right: IntervalTree | None = None
+        self.by_lower: list[tuple[int, int, int]] = []
+        self.by_upper: list[tuple[int, int, int]] = []
+        self.uppers: list[int] = []
+        if not intervals:
+            return
+        bounds = sorted(b for lower, upper, _ in intervals for b in (lower, upper))
+        self.center = bounds[(len(bounds) - 1) // 2]
+        left, right, here = [], [], []
+        for interval in intervals:
+            lower, upper, _ = interval
+            if upper <= self.center:
+                left.append(interval)
+            elif lower > self.center:
+                right.append(interval)
+            else:
+                here.append(interval)
+        self.by_lower = sorted(here)
+        self.by_upper = sorted(here, key=lambda x: x[1])
+        self.uppers = [upper for _, upper, _ in self.by_upper]
+        if left:
+            self.left = IntervalTree(left)
+        if right:
+            self.right = IntervalTree(right)
+
+    def overlap(self, lower: int, upper: int) -> list[int]:
+        """
+        Return the payloads of the intervals that overlap [lower, upper)
+        """
+        out: list[int] = []
+        node: IntervalTree | None = self
+        while node is not None:
+            if upper <= node.center:
+                # Keep the intervals here that start before the end of the query
+                n = bisect_left(node.by_lower, (upper,))
+                out.extend(p for _, _, p in node.by_lower[:n])
+                node = node.left
+            elif lower > node.center:
+                # Keep the intervals here that end after the start of the query
+                n = bisect_right(node.uppers, lower)
+                out.extend(p for _, _, p in node.by_upper[n:])
+                node = node.right
+            else:
+                # The query contains the center: every interval here overlaps it
+                out.extend(p for _, _, p in node.by_lower)
+                if node.left:
+                    out.extend(node.left.overlap(lower, upper))
+                node = node.right
+        return out
+
+
+class CorpusIndex:
+    """
+    In-memory index of the tables written by `run()`, used to preview
+    the results of a query locally without loading the corpus in a database.
+    Tokens are stored in parallel arrays indexed by `token_id - first_id`.
+    """
+
+    def __init__(self, speakers: dict[str, dict]):
+        self.speakers = speakers  # person_db: who_id -> {"sex", "birth", ..., "dialect"}
+        self.first_id = 0
+        self.columns: dict[str, list[str]] = {
+            attribute: [] for attribute in INDEXED_TOKEN_ATTRIBUTES
+        }
+        self.token_segments: list[str | None] = []  # None for IDs that are not indexed
+        self.char_starts = array("q")
+        self.char_ends = array("q")
+        self.flags = bytearray()
+        self.postings: dict[str, dict[str, list[int]]] = {
+            attribute: defaultdict(list) for attribute in INDEXED_TOKEN_ATTRIBUTES
+        }
+        self.segments: dict[str, dict] = {}
+        self.incidents: dict[int, dict] = {}
+        self.failed_files: dict[str, str] = {}  # file name -> error, see run()
+        self._incident_tree: IntervalTree | None = None
+
+    def add_token(
+        self,
+        token_id: int,
+        segment_id: str,
+        char_range: tuple[int, int],
+        form: str,
+        lemma: str,
+        xpos: str,
+        **flags: str,
+    ):
+        if not self.token_segments:
+            self.first_id = token_id
+        slot = token_id - self.first_id
+        if slot < len(self.token_segments):
+            raise ValueError(f"Token {token_id} was not added in increasing order")
+        while len(self.token_segments) < slot:
+            self._append_slot(None, (0, 0), ("", "", ""), 0)
+        values = tuple(sys.intern(v) for v in (form, lemma, xpos))
+        bits = sum(1 << n for n, f in enumerate(TOKEN_FLAGS) if flags.get(f) == "yes")
+        self._append_slot(segment_id, char_range, values, bits)
+        for attribute, value in zip(INDEXED_TOKEN_ATTRIBUTES, values):
+            self.postings[attribute][value].append(token_id)
+
+    def _append_slot(
+        self,
+        segment_id: str | None,
+        char_range: tuple[int, int],
+        values: tuple[str, ...],
+        bits: int,
+    ):
+        self.token_segments.append(segment_id)
+        self.char_starts.append(char_range[0])
+        self.char_ends.append(char_range[1])
+        self.flags.append(bits)
+        for column, value in zip(self.columns.values(), values):
+            column.append(value)
+
+    def add_segment(
+        self,
+        segment_id: str,
+        who: str,
+        char_range: tuple[int, int],
+        token_ids: range,
+        **meta: str,
+    ):
+        self.segments[segment_id] = {
+            **meta,
+            "who": who,
+            "char_range": char_range,
+            "tokens": token_ids,
+        }
+
+    def add_incident(self, incident_id: int, char_range: tuple[int, int], **meta: str):
+        self.incidents[incident_id] = {**meta, "char_range": char_range}
+        self._incident_tree = None
+
+    def merge(self, other: "CorpusIndex"):
+        """
+        Add the entries of `other`, e.g. the index of a single file.
+        Tokens of segments missing from `other` (the file failed before writing them) are left out
+        """
+        for tid in other.token_ids():
+            seg_id = other.segment_of(tid)
+            if seg_id not in other.segments:
+                continue
+            self.add_token(
+                tid,
+                seg_id,
+                other.char_range(tid),
+                *(other.token_value(tid, a) or "" for a in INDEXED_TOKEN_ATTRIBUTES),
+                **{f: other.token_value(tid, f) or "no" for f in TOKEN_FLAGS},
+            )
+        self.segments.update(other.segments)
+        self.incidents.update(other.incidents)
+        self.failed_files.update(other.failed_files)
+        self._incident_tree = None
+
+    def token_ids(self) -> list[int]:
+        return [
+            self.first_id + slot
+            for slot, seg_id in enumerate(self.token_segments)
+            if seg_id is not None
+        ]
+
+    def segment_of(self, token_id: int) -> str | None:
+        slot = token_id - self.first_id
+        if 0 <= slot < len(self.token_segments):
+            return self.token_segments[slot]
+        return None
+
+    def char_range(self, token_id: int) -> tuple[int, int]:
+        slot = token_id - self.first_id
+        return self.char_starts[slot], self.char_ends[slot]
+
+    def token_value(self, token_id: int, attribute: str) -> str | None:
+        slot = token_id - self.first_id
+        if attribute in self.columns:
+            return self.columns[attribute][slot]
+        if attribute in TOKEN_FLAGS:
+            bit = 1 << TOKEN_FLAGS.index(attribute)
+            return "yes" if self.flags[slot] & bit else "no"
+        return None
+
+    def token_matches(self, token_id: int, constraints: Constraints) -> bool:
+        return all(
+            matches(self.token_value(token_id, k), v) for k, v in constraints.items()
+        )
+
+    @property
+    def incident_tree(self) -> IntervalTree:
+        if self._incident_tree is None:
+            self._incident_tree = IntervalTree(
+                [(*i["char_range"], iid) for iid, i in self.incidents.items()]
+            )
+        return self._incident_tree
+
+    def overlapping_incidents(
+        self, lower: int, upper: int, constraints: Constraints | None = None
+    ) -> list[int]:
+        return sorted(
+            iid
+            for iid in self.incident_tree.overlap(lower, upper)
+            if all(
+                matches(self.incidents[iid].get(k), v)
+                for k, v in (constraints or {}).items()
+            )
+        )
+
+    def segment_value(self, segment_id: str, attribute: str) -> str | None:
+        segment = self.segments[segment_id]
+        if attribute.startswith("who."):
+            return self.speakers.get(segment["who"], {}).get(attribute[4:])
+        return segment.get(attribute)
+
+    def candidates(self, constraints: Constraints) -> list[int]:
+        """
+        Token IDs matching `constraints`, using the postings of the indexed attributes when possible
+        """
+        postings: list[set[int]] = []
+        for attribute, expected in constraints.items():
+            if attribute not in self.postings:
+                continue
+            if isinstance(expected, re.Pattern):
+                postings.append(
+                    {
+                        tid
+                        for value, tids in self.postings[attribute].items()
+                        if expected.search(value)
+                        for tid in tids
+                    }
+                )
+            else:
+                postings.append(set(self.postings[attribute].get(expected, [])))
+        ids = set.intersection(*postings) if postings else self.token_ids()
+        return sorted(tid for tid in ids if self.token_matches(tid, constraints))
+
+    def sequence(
+        self,
+        *tokens: Constraints,
+        segment: Constraints | None = None,
+        incident: Constraints | None = None,
+    ) -> list[tuple[str, list[int]]]:
+        """
+        Find the sequences of consecutive tokens matching `tokens` (one dict of constraints per token),
+        in segments matching `segment` and, if `incident` is given, overlapping a matching incident.
+        Return a list of (segment_id, token_ids)
+        """
+        if not tokens:
+            raise ValueError("sequence() needs at least one token constraint")
+        hits: list[tuple[str, list[int]]] = []
+        checked_segments: dict[str, bool] = {}
+        for first in self.candidates(tokens[0]):
+            seg_id = self.segment_of(first)
+            assert seg_id is not None
+            if seg_id not in checked_segments:
+                checked_segments[seg_id] = self.segment_matches(
+                    seg_id, segment, incident
+                )
+            if not checked_segments[seg_id]:
+                continue
+            ids = list(range(first, first + len(tokens)))
+            if all(
+                self.segment_of(tid) == seg_id and self.token_matches(tid, c)
+                for tid, c in zip(ids[1:], tokens[1:])
+            ):
+                hits.append((seg_id, ids))
+        return hits
+
+    def segment_matches(
+        self,
+        segment_id: str,
+        segment: Constraints | None = None,
+        incident: Constraints | None = None,
+    ) -> bool:
+        if not all(
+            matches(self.segment_value(segment_id, k), v)
+            for k, v in (segment or {}).items()
+        ):
+            return False
+        if incident is None:
+            return True
+        return bool(
+            self.overlapping_incidents(
+                *self.segments[segment_id]["char_range"], incident
+            )
+        )
+
+    def frequency(
+        self, hits: list[tuple[str, list[int]]], attribute: str = "who.dialect"
+    ) -> Counter:
+        return Counter(self.segment_value(seg_id, attribute) for seg_id, _ in hits)
+
+    def sample_query(self) -> tuple[list[tuple[str, list[int]]], Counter]:
+        """
+        Run the query in json_template["meta"]["sample_query"] and return its hits and dialect frequencies
+        """
+        # Keep in sync with json_template["meta"]["sample_query"] in tei_to_tables.py
+        hits = self.sequence(
+            {"xpos": "NN"},
+            {"pause_before": "yes"},
+            segment={"file_present": "yes"},
+            incident={"description": re.compile("auf den")},
+        )
+        return hits, self.frequency(hits, "who.dialect")
+
+    def plain(self, hit: tuple[str, list[int]]) -> str:
+        seg_id, ids = hit
+        return " ".join(
+            f"[{self.token_value(tid, 'form')}]"
+            if tid in ids
+            else str(self.token_value(tid, "form"))
+            for tid in self.segments[seg_id]["tokens"]
+        )
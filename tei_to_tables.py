@@ -4,6 +4,7 @@ import os
 import wave
 
 from collections import defaultdict
+from corpus_index import CorpusIndex
 from json import dumps
 from lxml import etree
 from tqdm import tqdm
@@ -288,7 +289,7 @@ def write_speakers():
             speakers_csv.writerow([speaker_id, dumps(props)])
 
 
-def parse_file(input_file, doc_name):
+def parse_file(input_file, doc_name, index: CorpusIndex | None = None):
 
     global char_cursor
     global token_id
@@ -338,6 +339,7 @@ def parse_file(input_file, doc_name):
         ):  # TODO: sort root.xpath(segs_xpath) by audio_name
             seg_id = str(uuid4())
             token_vector = []
+            start_token_seg = token_id
             start_char_seg = char_cursor
             start_audio_tok = audio_cursor
             start_audio_seg = audio_cursor
@@ -456,6 +458,21 @@ def parse_file(input_file, doc_name):
                             audio_frame_range,
                         ]
                     )
+                    if index is not None:
+                        index.add_token(
+                            token_id,
+                            seg_id,
+                            (start_char_tok, char_cursor),
+                            form=form,
+                            lemma=lemma,
+                            xpos=xpos,
+                            unclear=unclear,
+                            truncated=truncated,
+                            vocal=vocal,
+                            pause_before=pauseBefore,
+                            pause_after=pauseAfter,
+                            unintelligible=unintelligible,
+                        )
                     start_audio_tok = audio_cursor
                     token_vector.append(
                         (
@@ -490,6 +507,12 @@ def parse_file(input_file, doc_name):
                         csv.writer(ann_output).writerow(
                             [aid, meta, to_range(char_cursor, char_cursor + 1)]
                         )
+                        if index is not None and tag == "incident":
+                            index.add_incident(
+                                int(aid),
+                                (char_cursor, char_cursor + 1),
+                                description=desc.text,
+                            )
                 else:
                     pass
             start_audio_tok = audio_cursor
@@ -535,6 +558,15 @@ def parse_file(input_file, doc_name):
                     audio_meta_json,
                 ]
             )
+            if index is not None:
+                index.add_segment(
+                    seg_id,
+                    who,
+                    (start_char_seg, char_cursor - 1),
+                    range(start_token_seg, token_id),
+                    audio_file=audio_name,
+                    file_present=file_present,
+                )
             # TODO: include all 9 token attributes
             vector = " ".join(
                 " ".join(
@@ -584,7 +616,14 @@ def parse_file(input_file, doc_name):
                 ].append(value)
 
 
-def run():
+def run(build_index: bool = False) -> CorpusIndex | None:
+    """
+    Write the tables to ./output/\n
+    If `build_index==True`, also build and return an in-memory index to preview queries locally.\n
+    The index holds the same rows as the tables, including those written for a file before it failed,
+    except the tokens of the unfinished segment; the failed files are listed in `index.failed_files`.
+    """
+    index = CorpusIndex(person_db) if build_index else None
     load_people(PERSON_DB_FILE)
     load_docs(DOC_DB_FILE)
     with open("./output/document.csv", "w", encoding="utf-8") as doc_output, open(
@@ -642,13 +681,19 @@ def run():
         if not file.endswith(".xml"):
             continue
         doc_name = file.removesuffix(".xml").split("_")[0]
+        # Index each file separately to drop the tokens of its unfinished segment if it fails
+        file_index = CorpusIndex(person_db) if index is not None else None
         try:
-            parse_file(FOLDER + file, doc_name=doc_name)
+            parse_file(FOLDER + file, doc_name=doc_name, index=file_index)
         except Exception as e:
             # for now it should never be triggered, as I excluded problematic files
             print(f"Error processing file {file}: {e}")
-            continue
+            if file_index is not None:
+                file_index.failed_files[file] = repr(e)
+        if file_index is not None:
+            index.merge(file_index)
     write_forms_lemmas()
     write_speakers()
     with open("./output/meta.json", "w", encoding="utf-8") as json_file:
         json_file.write(dumps(json_template, indent="\t"))
+    return index
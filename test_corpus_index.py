@@ -0,0 +1,184 @@
+import csv
+import re
+
+import pytest
+
+from corpus_index import CorpusIndex, IntervalTree
+
+
+def build_index() -> CorpusIndex:
+    index = CorpusIndex({"A": {"dialect": "ZH"}, "B": {"dialect": "BE"}})
+    # segment s1 (speaker A): Haus gsi | segment s2 (speaker B): Hüüser ggange Haus
+    tokens = [
+        (1, "s1", (1, 5), "Haus", "Haus", "NN", "no"),
+        (2, "s1", (6, 9), "gsi", "sein", "VAPP", "yes"),
+        (3, "s2", (10, 16), "Hüüser", "Haus", "NN", "no"),
+        (4, "s2", (17, 23), "ggange", "gehen", "VVPP", "yes"),
+        (5, "s2", (24, 28), "Haus", "Haus", "NN", "no"),
+    ]
+    for tid, seg_id, char_range, form, lemma, xpos, pause_before in tokens:
+        index.add_token(
+            tid,
+            seg_id,
+            char_range,
+            form=form,
+            lemma=lemma,
+            xpos=xpos,
+            pause_before=pause_before,
+        )
+    index.add_segment("s1", "A", (1, 9), range(1, 3), file_present="yes")
+    index.add_segment("s2", "B", (10, 28), range(3, 6), file_present="no")
+    index.add_incident(1, (9, 10), description="lacht auf den Tisch")
+    return index
+
+
+def test_overlap_half_open_boundaries():
+    tree = IntervalTree([(5, 10, 1), (10, 12, 2), (0, 5, 3)])
+    assert sorted(tree.overlap(5, 10)) == [1]
+    assert sorted(tree.overlap(9, 11)) == [1, 2]
+    assert sorted(tree.overlap(4, 6)) == [1, 3]
+    assert tree.overlap(12, 20) == []
+
+
+def test_overlapping_incidents():
+    index = build_index()
+    # s1 is [1,9): it ends where the incident [9,10) starts
+    assert index.overlapping_incidents(1, 9) == []
+    assert index.overlapping_incidents(1, 10) == [1]
+    assert index.overlapping_incidents(1, 10, {"description": "auf den"}) == []
+    assert index.overlapping_incidents(
+        1, 10, {"description": re.compile("auf den")}
+    ) == [1]
+
+
+def test_candidates_literal_and_regex():
+    index = build_index()
+    assert index.candidates({"form": "Haus"}) == [1, 5]
+    assert index.candidates({"form": re.compile("^H")}) == [1, 3, 5]
+    assert index.candidates({"lemma": "Haus", "form": re.compile("üü")}) == [3]
+    # not indexed: falls back to filtering every token
+    assert index.candidates({"pause_before": "yes"}) == [2, 4]
+
+
+def test_sequence_does_not_cross_segments():
+    index = build_index()
+    # token 2 (end of s1) and token 3 (start of s2) are consecutive IDs
+    assert index.sequence({"form": "gsi"}, {"form": "Hüüser"}) == []
+    assert index.sequence({"xpos": "NN"}, {"pause_before": "yes"}) == [
+        ("s1", [1, 2]),
+        ("s2", [3, 4]),
+    ]
+    assert index.sequence(
+        {"xpos": "NN"}, {"pause_before": "yes"}, segment={"file_present": "no"}
+    ) == [("s2", [3, 4])]
+
+
+def test_sequence_needs_tokens():
+    with pytest.raises(ValueError):
+        build_index().sequence(segment={"file_present": "yes"})
+
+
+def test_frequency_dialect():
+    index = build_index()
+    hits = index.sequence({"lemma": "Haus"})
+    assert index.frequency(hits, "who.dialect") == {"ZH": 1, "BE": 2}
+
+
+def test_token_values():
+    index = build_index()
+    assert index.token_value(2, "lemma") == "sein"
+    assert index.token_value(2, "pause_before") == "yes"
+    assert index.token_value(3, "pause_before") == "no"
+    assert index.token_value(3, "unclear") == "no"
+    assert index.char_range(4) == (17, 23)
+
+
+def test_merge():
+    index = CorpusIndex({})
+    index.merge(build_index())
+    assert index.candidates({"form": "Haus"}) == [1, 5]
+    assert index.overlapping_incidents(9, 10) == [1]
+
+
+def test_merge_drops_tokens_of_missing_segments():
+    file_index = build_index()
+    del file_index.segments["s2"]
+    file_index.failed_files["x.xml"] = "IndexError()"
+    index = CorpusIndex({})
+    index.merge(file_index)
+    assert index.token_ids() == [1, 2]
+    assert index.candidates({"form": "Haus"}) == [1]
+    assert index.failed_files == {"x.xml": "IndexError()"}
+
+
+TEI = """<?xml version='1.0' encoding='UTF-8'?>
+<TEI xmlns="http://www.tei-c.org/ns/1.0">
+  <teiHeader><fileDesc><titleStmt><title>Transcription 9999</title></titleStmt></fileDesc></teiHeader>
+  <text>
+    <body>
+      <u start="media_pointers#d9999-T0" xml:id="d9999-u1" who="person_db#A">
+        <w normalised="haus" tag="NN" xml:id="d9999-u1-w1">huus</w>
+        <pause xml:id="d9999-u1-w2"/>
+        <w normalised="sein" tag="VAPP" xml:id="d9999-u1-w3">gsi</w>
+        <incident><desc xml:id="d9999-u1-w4">[lacht auf den tisch]</desc></incident>
+      </u>
+      <u start="media_pointers#d9999-T1" xml:id="d9999-u2" who="interviewer">
+        <incident><desc xml:id="d9999-u2-w1">[hustet]</desc></incident>
+        <w normalised="ja" tag="ITJ" xml:id="d9999-u2-w2">jaa</w>
+        <w normalised="genau" tag="ADV" xml:id="d9999-u2-w3">genau</w>
+      </u>
+    </body>
+  </text>
+</TEI>
+"""
+
+
+def read_rows(path) -> list[list[str]]:
+    with open(path, encoding="utf-8") as f:
+        return list(csv.reader(f))
+
+
+def test_parse_file_index_matches_tables(tmp_path, monkeypatch):
+    pytest.importorskip("lxml")
+    pytest.importorskip("tqdm")
+    import tei_to_tables
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "output").mkdir()
+    (tmp_path / "9999.xml").write_text(TEI, encoding="utf-8")
+    person_db = {"A": {"dialect": "ZH"}}
+    monkeypatch.setattr(tei_to_tables, "person_db", person_db)
+    monkeypatch.setattr(tei_to_tables, "doc_db", {"9999": {"SpeakerID": "A"}})
+    monkeypatch.setattr(tei_to_tables, "get_audio_length", lambda filename: 0.0)
+    monkeypatch.setattr(tei_to_tables, "concatenate_audio_files", lambda *args: None)
+
+    index = CorpusIndex(person_db)
+    tei_to_tables.parse_file("9999.xml", doc_name="9999", index=index)
+
+    tokens = read_rows("output/token.csv")
+    segments = read_rows("output/segment.csv")
+    incidents = read_rows("output/incident.csv")
+    assert len(tokens) == len(index.token_ids()) == 4
+    for row in tokens:
+        tid = int(row[0])
+        assert index.char_range(tid) == tei_to_tables.parse_range(row[10])
+        assert index.segment_of(tid) == row[11]
+        assert index.token_value(tid, "xpos") == row[3]
+        assert index.token_value(tid, "pause_before") == row[7]
+    assert index.token_value(int(tokens[1][0]), "pause_before") == "yes"
+    assert len(segments) == len(index.segments) == 2
+    for row in segments:
+        assert index.segments[row[0]]["who"] == row[1]
+        assert index.segments[row[0]]["char_range"] == tei_to_tables.parse_range(row[2])
+    assert len(incidents) == len(index.incidents) == 2
+    incident_ranges = {
+        int(row[0]): tei_to_tables.parse_range(row[2]) for row in incidents
+    }
+    for iid, char_range in incident_ranges.items():
+        assert index.incidents[iid]["char_range"] == char_range
+    # The overlaps in the index are the ones a database would compute from the tables
+    for row in segments:
+        lower, upper = tei_to_tables.parse_range(row[2])
+        assert index.overlapping_incidents(lower, upper) == sorted(
+            iid for iid, (a, b) in incident_ranges.items() if a < upper and lower < b
+        )